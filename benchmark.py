@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the normalization pipeline.
+
+Cold start: each measurement is a fresh interpreter, as in the short-lived jobs that invoke
+run.py, so import and start-up costs are included.
+  - import_run      python -c "import run"
+  - help            python run.py --help
+  - no_llm_run      python run.py --no-llm on the input file (end to end, deterministic stages only)
+
+Pipeline and server: the full pipeline including the owner/device LLM stages, served by the
+fake or replay LLM transport so results are repeatable and need no network.
+  - pipeline        run.py at each --llm-workers setting, plus a --local-shards run
+  - server          serve.py under concurrent single-record requests (micro-batching path)
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+REPO_DIR = Path(__file__).resolve().parent
+
+def _time_command(cmd: List[str], cwd: str, repeats: int) -> Dict:
+    timings = []
+    env = {**os.environ, "PYTHONPATH": str(REPO_DIR)}
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return {
+        "min_ms": round(min(timings) * 1000, 1),
+        "median_ms": round(statistics.median(timings) * 1000, 1),
+        "max_ms": round(max(timings) * 1000, 1),
+        "repeats": repeats,
+    }
+
+def bench_cold_start(input_file: str, repeats: int) -> Dict:
+    run_py = str(REPO_DIR / "run.py")
+    input_path = str(Path(input_file).resolve())
+    # Outputs (inventory_clean.csv, anomalies.json, metrics.json) go to a scratch directory
+    with tempfile.TemporaryDirectory() as workdir:
+        return {
+            "import_run": _time_command([sys.executable, "-c", "import run"], workdir, repeats),
+            "help": _time_command([sys.executable, run_py, "--help"], workdir, repeats),
+            "no_llm_run": _time_command([sys.executable, run_py, "--no-llm", "--input", input_path], workdir, repeats),
+        }
+
+def _llm_args(args: argparse.Namespace) -> List[str]:
+    llm_args = ["--llm-transport", args.llm_transport, "--llm-fixture", str(Path(args.llm_fixture).resolve())]
+    if args.llm_latency_ms is not None:
+        llm_args += ["--llm-latency-ms", str(args.llm_latency_ms)]
+    return llm_args
+
+def bench_pipeline(args: argparse.Namespace) -> Dict:
+    run_py = str(REPO_DIR / "run.py")
+    input_path = str(Path(args.input).resolve())
+    common = [sys.executable, run_py, "--input", input_path, "--no-checkpoint", *_llm_args(args)]
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for workers in args.llm_workers:
+            timing = _time_command([*common, "--llm-workers", str(workers)], workdir, args.repeats)
+            with open(Path(workdir) / "metrics.json", encoding="utf-8") as f:
+                metrics = json.load(f)
+            results[f"llm_workers_{workers}"] = {**timing, "rows": metrics["rows"], "llm_calls": metrics.get("llm_calls", 0)}
+        results[f"local_shards_{args.shards}"] = _time_command(
+            [*common, "--llm-workers", str(max(args.llm_workers)), "--local-shards", str(args.shards), "--shard-dir", str(Path(workdir) / "shards")],
+            workdir,
+            args.repeats,
+        )
+    return results
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def bench_server(args: argparse.Namespace) -> Dict:
+    import csv
+
+    with open(args.input, newline="", encoding="utf-8") as f:
+        records = list(csv.DictReader(f))
+    # Enough requests to fill several micro-batches, reusing the input rows under fresh ids
+    requests = [{**records[i % len(records)], "source_row_id": i} for i in range(args.server_requests)]
+
+    port = _free_port()
+    env = {**os.environ, "PYTHONPATH": str(REPO_DIR)}
+    server = subprocess.Popen(
+        [sys.executable, str(REPO_DIR / "serve.py"), "--port", str(port), *_llm_args(args)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                urllib.request.urlopen(f"{base_url}/healthz")
+                break
+            except OSError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError("serve.py did not start")
+                time.sleep(0.05)
+
+        def post(record: Dict) -> None:
+            request = urllib.request.Request(
+                f"{base_url}/normalize",
+                data=json.dumps(record).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+            )
+            urllib.request.urlopen(request).read()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.server_concurrency) as executor:
+            list(executor.map(post, requests))
+        elapsed = time.perf_counter() - start
+        with urllib.request.urlopen(f"{base_url}/stats") as response:
+            stats = json.load(response)
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "requests": len(requests),
+        "concurrency": args.server_concurrency,
+        "requests_per_s": round(len(requests) / elapsed, 1),
+        **stats,
+    }
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the inventory normalization pipeline")
+    parser.add_argument("--input", default=str(REPO_DIR / "inventory_raw.csv"))
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--suite", choices=["cold_start", "pipeline", "server", "all"], default="all")
+    parser.add_argument("--llm-transport", choices=["fake", "replay"], default="fake", help="Offline LLM transport for the pipeline and server benchmarks")
+    parser.add_argument("--llm-fixture", default="llm_fixture.jsonl", help="Recorded fixture for --llm-transport replay")
+    parser.add_argument("--llm-latency-ms", type=float, default=20.0, help="Synthetic latency per LLM request")
+    parser.add_argument("--llm-workers", type=int, nargs="+", default=[1, 8], help="--llm-workers settings to compare")
+    parser.add_argument("--shards", type=int, default=2, help="Shards for the --local-shards run")
+    parser.add_argument("--server-requests", type=int, default=200)
+    parser.add_argument("--server-concurrency", type=int, default=16)
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file instead of stdout")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    results = {}
+    if args.suite in ("cold_start", "all"):
+        results["cold_start"] = bench_cold_start(args.input, args.repeats)
+    if args.suite in ("pipeline", "all"):
+        results["pipeline"] = bench_pipeline(args)
+    if args.suite in ("server", "all"):
+        results["server"] = bench_server(args)
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+import pandas as pd
+
+MANIFEST_FILE = "manifest.json"
+
+class CheckpointMismatch(ValueError):
+    """
+    Raised when resuming a run whose input or settings differ from the checkpointed run, or
+    when the run directory holds files that were not written by a checkpoint store.
+    """
+
+def fingerprint_file(path: str, block_size: int = 1 << 20) -> Dict:
+    """
+    Return the size and SHA-256 of a file, read in blocks.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+    return {"size": size, "sha256": digest.hexdigest()}
+
+def _json_default(value):
+    # numpy scalars (e.g. int64 row ids) expose .item()
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+def atomic_write_json(path: Path, payload) -> None:
+    """
+    Write JSON to a temporary file in the same directory, fsync it and rename it over path,
+    so readers only ever see a complete file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, default=_json_default)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class CheckpointStore:
+    """
+    Per-stage, per-chunk results of a run, stored under run_dir as
+    <stage>/chunk-<n>.json next to a manifest describing the input, chunking and run settings.
+    """
+
+    def __init__(self, run_dir: str, chunk_size: int = 1000):
+        self.run_dir = Path(run_dir)
+        self.chunk_size = chunk_size
+        self.loaded_chunks = 0
+        self.saved_chunks = 0
+
+    def start(self, input_path: str, resume: bool = False, settings: Optional[Dict] = None) -> None:
+        """
+        Prepare the run directory. A fresh run discards earlier checkpoints; a resumed run
+        checks that the input file, chunk size and settings (anything else that determines
+        the stage results, e.g. LLM transport, model and prompts) match the checkpointed run.
+        """
+        manifest = {
+            "input": str(Path(input_path).resolve()),
+            **fingerprint_file(input_path),
+            "chunk_size": self.chunk_size,
+            # Round-tripped through JSON so it compares equal to the stored copy
+            "settings": json.loads(json.dumps(settings or {}, default=_json_default)),
+        }
+        manifest_path = self.run_dir / MANIFEST_FILE
+        if resume:
+            if not manifest_path.exists():
+                raise CheckpointMismatch(f"No checkpoint to resume in {self.run_dir}")
+            with open(manifest_path, encoding="utf-8") as f:
+                previous = json.load(f)
+            if previous.get("sha256") != manifest["sha256"] or previous.get("size") != manifest["size"]:
+                raise CheckpointMismatch(f"{input_path} has changed since the checkpoint in {self.run_dir} was written")
+            if previous.get("chunk_size") != self.chunk_size:
+                raise CheckpointMismatch(
+                    f"Checkpoint in {self.run_dir} used --chunk-size {previous.get('chunk_size')}, not {self.chunk_size}"
+                )
+            previous_settings = previous.get("settings", {})
+            changed = sorted(
+                key for key in set(previous_settings) | set(manifest["settings"])
+                if previous_settings.get(key) != manifest["settings"].get(key)
+            )
+            if changed:
+                raise CheckpointMismatch(
+                    f"Checkpoint in {self.run_dir} was written with different settings: "
+                    + ", ".join(f"{key} {previous_settings.get(key)!r} -> {manifest['settings'].get(key)!r}" for key in changed)
+                )
+            return
+        self._clear()
+        atomic_write_json(manifest_path, manifest)
+
+    def _clear(self) -> None:
+        """
+        Remove the checkpoints of an earlier run: its manifest and the chunk files of each stage.
+        Anything else in run_dir is left alone, and a non-empty run_dir without a manifest is
+        refused so that --run-dir cannot wipe an unrelated directory.
+        """
+        if not self.run_dir.exists():
+            return
+        manifest_path = self.run_dir / MANIFEST_FILE
+        if not manifest_path.exists():
+            if any(self.run_dir.iterdir()):
+                raise CheckpointMismatch(
+                    f"{self.run_dir} is not empty and holds no checkpoint manifest; choose another --run-dir"
+                )
+            return
+        for stage_dir in self.run_dir.iterdir():
+            if not stage_dir.is_dir():
+                continue
+            # Includes temporary files left behind by an interrupted atomic write
+            for chunk_path in [*stage_dir.glob("chunk-*.json"), *stage_dir.glob(".chunk-*.json.*.tmp")]:
+                chunk_path.unlink()
+            if not any(stage_dir.iterdir()):
+                stage_dir.rmdir()
+        manifest_path.unlink()
+
+    def _chunk_path(self, stage: str, chunk_index: int) -> Path:
+        return self.run_dir / stage / f"chunk-{chunk_index:06d}.json"
+
+    def load(self, stage: str, chunk_index: int, expected_index: Optional[pd.Index] = None) -> Optional[pd.DataFrame]:
+        """
+        Return the checkpointed results of a chunk, or None if it has not completed.
+        With expected_index, raises CheckpointMismatch unless the chunk holds exactly those rows.
+        """
+        path = self._chunk_path(stage, chunk_index)
+        if not path.exists():
+            return None
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+        if expected_index is not None and payload["index"] != json.loads(json.dumps(list(expected_index), default=_json_default)):
+            raise CheckpointMismatch(f"Chunk {chunk_index} of {stage} in {self.run_dir} holds different rows than this run")
+        self.loaded_chunks += 1
+        return pd.DataFrame(
+            payload["data"],
+            index=pd.Index(payload["index"], name=payload["index_name"]),
+            columns=payload["columns"],
+        )
+
+    def save(self, stage: str, chunk_index: int, result_df: pd.DataFrame) -> None:
+        payload = result_df.to_dict(orient="split")
+        payload["index_name"] = result_df.index.name
+        atomic_write_json(self._chunk_path(stage, chunk_index), payload)
+        self.saved_chunks += 1
+
+    def stats(self) -> Dict:
+        return {
+            "checkpoint_chunks_resumed": self.loaded_chunks,
+            "checkpoint_chunks_written": self.saved_chunks,
+        }
@@ -0,0 +1,48 @@
+import pandas as pd
+from typing import Dict, List
+
+# Fields that should identify a single record across the whole inventory
+UNIQUE_FIELDS = ["ip", "mac", "hostname", "fqdn"]
+
+def is_true_flag(values: pd.Series) -> pd.Series:
+    # Validity flags are "True"/"False" strings in memory and booleans once read back from Parquet/Arrow
+    return values.astype(str).str.strip().str.lower() == "true"
+
+def find_cross_row_conflicts(clean_df: pd.DataFrame) -> List[Dict]:
+    """
+    Flag valid ip/mac/hostname/fqdn values that appear on more than one record.
+    Works on the clean inventory (indexed by source_row_id) and returns anomaly records
+    in the anomalies.json format, one per affected row.
+    """
+    conflicts: Dict = {}
+    for field in UNIQUE_FIELDS:
+        if field not in clean_df.columns or f"{field}_valid" not in clean_df.columns:
+            continue
+        values = clean_df.loc[is_true_flag(clean_df[f"{field}_valid"]), field].dropna()
+        values = values[values.astype(str).str.strip() != ""]
+        duplicated = values[values.duplicated(keep=False)]
+        for value, group in duplicated.groupby(duplicated):
+            row_ids = list(group.index)
+            for source_row_id in row_ids:
+                others = ", ".join(str(i) for i in row_ids if i != source_row_id)
+                record = conflicts.setdefault(source_row_id, {"source_row_id": source_row_id, "issues": [], "recommended_actions": []})
+                record["issues"].append({"field": field, "type": f"duplicate_{field}", "value": value})
+                record["recommended_actions"].append(f"Resolve duplicate {field} shared with source_row_id {others}")
+    return [conflicts[source_row_id] for source_row_id in clean_df.index if source_row_id in conflicts]
+
+def merge_anomalies(anomaly_records: List[Dict], extra_records: List[Dict]) -> List[Dict]:
+    """
+    Fold extra anomaly records into anomaly_records by source_row_id; rows missing from
+    anomaly_records are appended.
+    """
+    by_row = {record["source_row_id"]: record for record in anomaly_records}
+    merged = list(anomaly_records)
+    for extra in extra_records:
+        record = by_row.get(extra["source_row_id"])
+        if record is None:
+            record = {"source_row_id": extra["source_row_id"], "issues": [], "recommended_actions": []}
+            by_row[extra["source_row_id"]] = record
+            merged.append(record)
+        record["issues"].extend(extra["issues"])
+        record["recommended_actions"].extend(extra["recommended_actions"])
+    return merged
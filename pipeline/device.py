@@ -1,5 +1,22 @@
-from pipeline.llm import GPTClient
-from typing import Dict
+from pipeline.llm import GPTClient, LLMResponseError, TokenBudgetExceeded
+from typing import Dict, List
+
+DEVICE_SCHEMA = {
+    "name": "device",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "device_out": {"type": "string"},
+            "device_type_confidence": {"type": "string", "enum": ["low", "mid", "high", ""]},
+        },
+        "required": ["device_out", "device_type_confidence"],
+        "additionalProperties": False,
+    },
+}
+
+# Other names the model uses for DEVICE_SCHEMA fields; needed where "name" or "type" is ambiguous (fused stage)
+DEVICE_KEY_ALIASES = {"type": "device_out", "device_type": "device_out"}
 
 def trim_device_type_str(device_type: str) -> str:
     try:
@@ -7,13 +24,55 @@ def trim_device_type_str(device_type: str) -> str:
     except Exception:
         return ""
     
+def device_needs_llm(device: str, hostname: str, notes: str) -> bool:
+    """
+    Deterministic tier: with no device type, hostname or notes there is nothing to classify.
+    """
+    return any(isinstance(v, str) and v.strip() != "" for v in (device, hostname, notes))
+
+def device_prompt_data(device: str, hostname: str, notes: str) -> str:
+    return f"Hostname: {hostname} Device Type: {trim_device_type_str(device)} Notes: {notes}"
+
 def process_device(device: str, hostname: str, notes: str, llm: GPTClient, device_prompt: str, system_prompt: str) -> Dict:
     steps = []
-    notes = []
     steps.append("device_trim")
-    device_prompt_augmented = device_prompt + f"Hostname: {hostname} Device Type: {trim_device_type_str(device)} Notes: {notes}"
-    device = llm.generate(system_prompt, device_prompt_augmented)
+    if not device_needs_llm(device, hostname, notes):
+        steps.append("device_skipped_empty_input")
+        return build_device_result({field: "" for field in DEVICE_SCHEMA["schema"]["required"]}, steps)
+    device_prompt_augmented = device_prompt_data(device, hostname, notes)
+    try:
+        device = llm.generate(system_prompt + device_prompt, device_prompt_augmented, schema=DEVICE_SCHEMA, key_aliases=DEVICE_KEY_ALIASES)
+    except TokenBudgetExceeded:
+        return device_budget_exhausted_result(steps)
+    except LLMResponseError:
+        return device_invalid_response_result(steps)
     steps.append("device_parse")
+    return build_device_result(device, steps)
+
+def device_budget_exhausted_result(steps: List[str]) -> Dict:
+    steps.append("device_skipped_token_budget_exhausted")
+    return {
+        **{field: "" for field in DEVICE_SCHEMA["schema"]["required"]},
+        "device_issues": "Token budget exhausted",
+        "device_recommended_action": "Re-run device normalization with a larger token budget",
+        "device_normalization_steps": "|".join(steps)
+    }
+
+def device_invalid_response_result(steps: List[str]) -> Dict:
+    steps.append("device_invalid_llm_response")
+    return {
+        **{field: "" for field in DEVICE_SCHEMA["schema"]["required"]},
+        "device_issues": "Unparseable LLM response",
+        "device_recommended_action": "Re-run device normalization or correct device manually",
+        "device_normalization_steps": "|".join(steps)
+    }
+
+def build_device_result(device: Dict, steps: List[str]) -> Dict:
+    """
+    Add the device issue, recommended action and normalization steps to the parsed device fields.
+    """
+    # Only the schema's fields are kept, and a missing field counts as empty
+    device = {field: device.get(field, "") for field in DEVICE_SCHEMA["schema"]["required"]}
     if any(v == "" for v in device.values()):
         device_issues = "Missing device fields"
         device_recommended_action = "Correct device or mark record for revision"
@@ -26,4 +85,17 @@ def process_device(device: str, hostname: str, notes: str, llm: GPTClient, devic
         "device_issues": device_issues,
         "device_recommended_action": device_recommended_action,
         "device_normalization_steps": "|".join(steps)
+    }
+
+def skip_device(device_type: str) -> Dict:
+    """
+    Result used when the LLM stages are disabled (--no-llm): the trimmed input is kept as
+    device_out, the remaining fields are left empty and the record is flagged as skipped.
+    """
+    return {
+        **{field: "" for field in DEVICE_SCHEMA["schema"]["required"]},
+        "device_out": trim_device_type_str(device_type) if isinstance(device_type, str) else "",
+        "device_issues": "Skipped (LLM stages disabled)",
+        "device_recommended_action": "Re-run without --no-llm to normalize device",
+        "device_normalization_steps": "device_skipped_no_llm"
     }
\ No newline at end of file
@@ -1,39 +1,216 @@
-from openai import OpenAI
-from dotenv import load_dotenv
-import os
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional
 import json
+import threading
+
+from pipeline.llm_response import LLMResponseError, parse_response
+from pipeline.transport import OpenAITransport
+
+# Output budget per JSON field; short strings such as a name or a team fit well within it
+MAX_TOKENS_PER_FIELD = 24
+
+class TokenBudgetExceeded(RuntimeError):
+    """Raised when sending a prompt would take the run over its token budget."""
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """
+    Count tokens in text with the model's tokenizer.
+    Falls back to a ~4 characters per token estimate when tiktoken is not installed.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
+
+def estimate_prompt_tokens(messages: List[Dict], schema: Optional[Dict] = None, model: str = "gpt-4o-mini") -> int:
+    """
+    Local estimate of the prompt size: message contents with per-message framing overhead,
+    plus the response_format schema, which the provider also bills as prompt tokens.
+    """
+    tokens = sum(count_tokens(m["content"], model) + 4 for m in messages) + 3
+    if schema is not None:
+        tokens += count_tokens(json.dumps(schema, separators=(",", ":")), model)
+    return tokens
+
+def schema_max_tokens(schema: Dict) -> int:
+    """
+    Completion cap for a structured response: a fixed allowance per field plus JSON punctuation.
+    """
+    fields = schema["schema"]["properties"]
+    return MAX_TOKENS_PER_FIELD * len(fields) + 8
 
 class GPTClient:
-    def __init__(self, model="gpt-4o-mini", temperature=0.2):
-        # Load environment variables from .env
-        load_dotenv()
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not found in .env")
-
-        # Initialize the OpenAI client
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, model="gpt-4o-mini", temperature=0.2, token_budget: Optional[int] = None, cache_size: int = 4096, transport=None, max_retries: int = 1):
+        # The transport carries requests to the model (live API, record/replay fixture or fake);
+        # the default OpenAI transport defers its imports and OPENAI_API_KEY check until the first request
+        self.transport = transport if transport is not None else OpenAITransport()
         self.model = model
         self.temperature = temperature
 
-    def generate(self, system_prompt: str, prompt: str) -> str:
-        """Send a prompt and return the model's text output."""
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=self.temperature,
-        )
-        response = response.choices[0].message.content.strip()
-        if response.startswith("```"):
-            response = response.strip("`").replace("json", "", 1).strip()
-
-        return json.loads(response)
+        # Per-run token accounting; once the budget is spent no further calls are sent
+        self.token_budget = token_budget
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.budget_rejections = 0
+
+        # Reply validation: locally repaired replies by repair kind, re-sent requests and replies that failed validation
+        self.max_retries = max_retries
+        self.repaired_responses = 0
+        self.repairs: Dict[str, int] = {}
+        self.retries = 0
+        self.invalid_responses = 0
+        # Requests that still had no valid reply after the retries (LLMResponseError raised)
+        self.failed_responses = 0
+
+        # LRU cache of parsed responses keyed by the full request; repeated owner/device strings are common
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self._cache: OrderedDict = OrderedDict()
+
+        # Tokens reserved by requests still in flight, so concurrent callers cannot overshoot the budget
+        self._reserved_tokens = 0
+
+        # generate() may be called from several threads (concurrent stages, server mode)
+        self._lock = threading.Lock()
+
+    @property
+    def tokens_used(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def count_prompt_tokens(self, messages: List[Dict], schema: Optional[Dict] = None) -> int:
+        """Local estimate of the prompt size, including framing overhead and the response schema."""
+        return estimate_prompt_tokens(messages, schema, self.model)
+
+    def stats(self) -> Dict:
+        return {
+            "llm_calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "token_budget": self.token_budget,
+            "budget_rejections": self.budget_rejections,
+            "cache_hits": self.cache_hits,
+            "repaired_responses": self.repaired_responses,
+            "repairs": dict(self.repairs),
+            "llm_retries": self.retries,
+            "invalid_responses": self.invalid_responses,
+            "failed_responses": self.failed_responses,
+        }
+
+    def _send(self, request: Dict, schema: Optional[Dict], max_tokens: Optional[int]) -> str:
+        """Send one request through the transport under the token budget and return the reply text."""
+        reserved = 0
+        if self.token_budget is not None:
+            with self._lock:
+                reserved = self.count_prompt_tokens(request["messages"], schema) + (max_tokens or 0)
+                # Once the budget has been hit, stay stopped rather than letting smaller prompts through
+                if self.budget_rejections or self.tokens_used + self._reserved_tokens + reserved > self.token_budget:
+                    self.budget_rejections += 1
+                    raise TokenBudgetExceeded(
+                        f"Token budget of {self.token_budget} exhausted ({self.tokens_used} used, {reserved} requested)"
+                    )
+                self._reserved_tokens += reserved
+
+        try:
+            response = self.transport.complete(request)
+        except BaseException:
+            with self._lock:
+                self._reserved_tokens -= reserved
+            raise
+        usage = response.get("usage") or {}
+        # The reservation is swapped for the actual usage in one step, so concurrent callers
+        # checking the budget never see the tokens of this request as neither reserved nor used
+        with self._lock:
+            self._reserved_tokens -= reserved
+            self.calls += 1
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+            self.cached_prompt_tokens += usage.get("cached_tokens", 0)
+        return response["content"]
+
+    def generate(self, system_prompt: str, prompt: str, schema: Optional[Dict] = None, max_tokens: Optional[int] = None, key_aliases: Optional[Dict[str, str]] = None) -> Dict:
+        """
+        Send a prompt and return the model's JSON output as a dict.
+
+        The system prompt should carry all static instructions so that the request prefix
+        is identical across rows (provider-side prompt caching applies once that prefix
+        reaches the provider's minimum, 1024 tokens for OpenAI); the user prompt should only
+        carry the row data.
+        When a schema is given the model is constrained to it via structured outputs, and the
+        reply is validated against it (see pipeline.llm_response); replies that cannot be
+        repaired locally are re-requested up to max_retries times before LLMResponseError is raised.
+        key_aliases maps other names the model may use for a schema field to the field's key.
+        """
+        messages = [
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+        if max_tokens is None and schema is not None:
+            max_tokens = schema_max_tokens(schema)
+
+        cache_key = (system_prompt, prompt, schema["name"] if schema else None, max_tokens)
+        with self._lock:
+            if cache_key in self._cache:
+                self._cache.move_to_end(cache_key)
+                self.cache_hits += 1
+                return dict(self._cache[cache_key])
+
+        kwargs = {}
+        if schema is not None:
+            kwargs["response_format"] = {"type": "json_schema", "json_schema": schema}
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        request = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": self.temperature,
+            **kwargs,
+        }
+
+        # Malformed replies are repaired locally; the request is only re-sent when repair fails
+        for attempt in range(self.max_retries + 1):
+            content = self._send(request, schema, max_tokens)
+            try:
+                result, repairs = parse_response(content, schema, key_aliases)
+                break
+            except LLMResponseError:
+                with self._lock:
+                    self.invalid_responses += 1
+                    if attempt < self.max_retries:
+                        self.retries += 1
+                    else:
+                        self.failed_responses += 1
+                if attempt == self.max_retries:
+                    raise
+        if repairs:
+            with self._lock:
+                self.repaired_responses += 1
+                for repair in repairs:
+                    self.repairs[repair] = self.repairs.get(repair, 0) + 1
+
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[cache_key] = dict(result)
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
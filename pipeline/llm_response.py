@@ -0,0 +1,261 @@
+import ast
+import difflib
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Parsing and validation of structured LLM replies against the json_schema sent with the request.
+# Common defects are repaired locally so that only replies that cannot be salvaged are re-requested.
+
+EMAIL_RE = re.compile(r"[^@\s'\"<>(),;]+@[^@\s'\"<>(),;]+\.[^@\s'\"<>(),;.]+")
+CODE_FENCE_RE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+
+# Generic words models use for the extracted value in place of the schema's only *_out field;
+# stage-specific names (e.g. "name" for owner_out when several *_out fields exist) are passed in
+# by the caller as key_aliases
+OUT_FIELD_WORDS = {"name", "value", "output", "result"}
+
+# Common out-of-vocabulary answers for enum fields, applied only when the target is in the enum
+ENUM_SYNONYMS = {
+    "medium": "mid",
+    "med": "mid",
+    "moderate": "mid",
+    "middle": "mid",
+    "none": "",
+    "unknown": "",
+    "n/a": "",
+}
+
+class LLMResponseError(ValueError):
+    """Raised when an LLM reply cannot be parsed into the requested schema, even after repair."""
+
+def validate_response(result, schema: Optional[Dict]) -> List[str]:
+    """
+    Check a parsed reply against the request's json_schema: an object with every required key,
+    no unexpected keys, string values, enum membership and pattern matches.
+    Returns the list of violations; empty when the reply is valid.
+    """
+    if not isinstance(result, dict):
+        return [f"expected a JSON object, got {type(result).__name__}"]
+    if schema is None:
+        return []
+    spec = schema["schema"]
+    properties = spec.get("properties", {})
+    errors = [f"missing key {key!r}" for key in spec.get("required", []) if key not in result]
+    if spec.get("additionalProperties") is False:
+        errors += [f"unexpected key {key!r}" for key in result if key not in properties]
+    for key, field in properties.items():
+        if key not in result:
+            continue
+        value = result[key]
+        if field.get("type") == "string" and not isinstance(value, str):
+            errors.append(f"{key!r} is not a string")
+        elif "enum" in field and value not in field["enum"]:
+            errors.append(f"{key!r} is not one of {field['enum']}")
+        elif "pattern" in field and not re.search(field["pattern"], value):
+            errors.append(f"{key!r} does not match {field['pattern']}")
+    return errors
+
+def _scan(text: str) -> Tuple[List[str], Optional[int], int]:
+    """
+    Track brackets and strings (double- or single-quoted) through text, which starts with a bracket.
+    Returns the closers still open at the end, the start of a string left unterminated (or None),
+    and the position just past the bracket that balances the first one (-1 if it never closes).
+    """
+    stack = []
+    quote = None
+    escaped = False
+    string_start = None
+    for position, char in enumerate(text):
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+                string_start = None
+        elif char in "\"'":
+            quote = char
+            string_start = position
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+            if not stack:
+                return [], None, position + 1
+    return stack, string_start, -1
+
+def _close_truncated(text: str) -> str:
+    """
+    Close an object cut off mid-way (e.g. by max_tokens): drop the unfinished field and close
+    open brackets. The fields that were cut off are filled in later by _repair_fields.
+    """
+    stack, string_start, _ = _scan(text)
+    # A string cut off mid-way is incomplete, whether key or value, so it is dropped along with
+    # any dangling separator or key without a value
+    if string_start is not None:
+        text = text[:string_start]
+    text = text.rstrip()
+    text = re.sub(r'''(?:,\s*["'][^"']*["']\s*:?|(?<=\{)\s*["'][^"']*["']\s*:?|,)\s*$''', "", text)
+    return text + "".join(reversed(stack))
+
+def _load_object(text: str, repairs: List[str]):
+    """Decode text as JSON, falling back to progressively more invasive syntax repairs."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    # Cut the object at the brace that balances its opening one, so prose or a stray closing
+    # brace after it is dropped as well as prose before it
+    start = text.find("{")
+    if start >= 0:
+        end = _scan(text[start:])[2]
+        candidate = text[start:start + end] if end > 0 else text[start:]
+        if candidate != text:
+            repairs.append("surrounding_prose")
+            text = candidate
+            try:
+                return json.loads(text)
+            except json.JSONDecodeError:
+                pass
+
+    # Python-style dicts: single quotes, True/False/None
+    try:
+        result = ast.literal_eval(text)
+        repairs.append("single_quotes")
+        return result
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        pass
+
+    closed = _close_truncated(text)
+    try:
+        result = json.loads(closed)
+        repairs.append("truncated_object")
+        return result
+    except json.JSONDecodeError:
+        pass
+    try:
+        result = ast.literal_eval(closed)
+        repairs.extend(["single_quotes", "truncated_object"])
+        return result
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        pass
+    raise LLMResponseError(f"Could not decode LLM reply as JSON: {text[:200]!r}")
+
+def _normalize_key(key: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(key).lower())
+
+def _match_key(key: str, expected: List[str], key_aliases: Optional[Dict[str, str]] = None) -> Optional[str]:
+    """
+    Map a misnamed key onto an expected one: the same name ignoring case and separators, the
+    field's last word ("email" for owner_email), the stem of an *_out field ("owner" for
+    owner_out), a caller-supplied alias, a generic word such as "name" for the only *_out field,
+    a close spelling, or a longer name starting with an *_out field's stem.
+    """
+    normalized = _normalize_key(key)
+    aliases = {_normalize_key(alias): field for alias, field in (key_aliases or {}).items()}
+    by_name = {_normalize_key(candidate): candidate for candidate in expected}
+    by_suffix = {
+        _normalize_key(candidate.rsplit("_", 1)[-1]): candidate
+        for candidate in expected
+        if not candidate.endswith("_out")
+    }
+    by_prefix = {_normalize_key(candidate[:-len("_out")]): candidate for candidate in expected if candidate.endswith("_out")}
+    for lookup in (by_name, by_suffix, by_prefix):
+        if normalized in lookup:
+            return lookup[normalized]
+    if aliases.get(normalized) in expected:
+        return aliases[normalized]
+    if normalized in OUT_FIELD_WORDS and len(by_prefix) == 1:
+        return next(iter(by_prefix.values()))
+    close = difflib.get_close_matches(normalized, list(by_name), n=1, cutoff=0.85)
+    if close:
+        return by_name[close[0]]
+    # e.g. "device_type" or "owner_name" for the *_out field of the same stem
+    stems = [stem for stem in by_prefix if normalized.startswith(stem)]
+    return by_prefix[stems[0]] if len(stems) == 1 else None
+
+def _repair_fields(result: Dict, schema: Dict, repairs: List[str], key_aliases: Optional[Dict[str, str]] = None) -> Dict:
+    spec = schema["schema"]
+    properties = spec.get("properties", {})
+    required = spec.get("required", [])
+
+    repaired = {key: value for key, value in result.items() if key in properties}
+    for key, value in result.items():
+        if key in properties:
+            continue
+        target = _match_key(key, [k for k in required if k not in repaired], key_aliases)
+        if target is not None:
+            repaired[target] = value
+            repairs.append("renamed_key")
+        elif spec.get("additionalProperties") is False:
+            repairs.append("dropped_key")
+        else:
+            repaired[key] = value
+
+    # Fields lost to truncation become empty strings rather than a re-request: the same request
+    # would be cut off at the same max_tokens, and the result builders flag empty fields anyway
+    if "truncated_object" in repairs:
+        for key in required:
+            if key not in repaired and properties.get(key, {}).get("type") == "string":
+                repaired[key] = ""
+                repairs.append("filled_truncated_field")
+
+    for key, field in properties.items():
+        if key not in repaired:
+            continue
+        value = repaired[key]
+        if field.get("type") == "string" and not isinstance(value, str):
+            # Only scalars have an obvious string form; lists and objects are left to fail validation
+            if value is not None and not isinstance(value, (int, float, bool)):
+                continue
+            repaired[key] = "" if value is None else str(value)
+            repairs.append("coerced_type")
+            value = repaired[key]
+        if "enum" in field and value not in field["enum"]:
+            folded = {str(choice).lower(): choice for choice in field["enum"]}
+            answer = value.strip().lower()
+            if answer in folded:
+                repaired[key] = folded[answer]
+                repairs.append("enum_case")
+            elif ENUM_SYNONYMS.get(answer) in field["enum"]:
+                repaired[key] = ENUM_SYNONYMS[answer]
+                repairs.append("enum_synonym")
+        elif "pattern" in field and not re.search(field["pattern"], value):
+            stripped = value.strip()
+            if re.search(field["pattern"], stripped):
+                repaired[key] = stripped
+                repairs.append("whitespace")
+            elif "email" in key:
+                match = EMAIL_RE.search(value)
+                if match and re.search(field["pattern"], match.group(0)):
+                    repaired[key] = match.group(0)
+                    repairs.append("extracted_email")
+    return repaired
+
+def parse_response(content: str, schema: Optional[Dict] = None, key_aliases: Optional[Dict[str, str]] = None) -> Tuple[Dict, List[str]]:
+    """
+    Parse an LLM reply and validate it against the request's schema, repairing common defects
+    locally: code fences, prose around the object, single quotes, truncation (fields that were
+    cut off are left empty), misnamed keys, non-string scalar values, enum case or synonyms
+    ("medium" for "mid") and emails wrapped in other text.
+
+    key_aliases maps other names the model may use for a field to the schema's key.
+
+    Returns the reply and the list of repairs applied (empty for a clean reply).
+    Raises LLMResponseError when the reply still does not satisfy the schema.
+    """
+    repairs: List[str] = []
+    text = (content or "").strip()
+    if text.startswith("```"):
+        text = CODE_FENCE_RE.sub("", text).strip()
+        repairs.append("code_fence")
+    result = _load_object(text, repairs)
+    if isinstance(result, dict) and schema is not None and validate_response(result, schema):
+        result = _repair_fields(result, schema, repairs, key_aliases)
+    errors = validate_response(result, schema)
+    if errors:
+        raise LLMResponseError("LLM reply does not match the schema: " + "; ".join(errors))
+    return result, repairs
@@ -0,0 +1,218 @@
+import gzip
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from pipeline.consistency import is_true_flag
+from pipeline.ip import validate_and_label_ipv4
+from pipeline.mac import validate_and_label_mac
+
+IPV4_RE = re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}\b")
+MAC_RE = re.compile(r"\b[0-9A-Fa-f]{1,2}(?::[0-9A-Fa-f]{1,2}){5}\b")
+LEASE_START_RE = re.compile(r"^lease\s+(\S+)\s*\{")
+# dhcpd writes times as "<weekday> YYYY/MM/DD HH:MM:SS" in UTC, or "epoch <seconds>; # ..." with db-time-format local
+LEASE_TIME_RE = re.compile(r"^(starts|ends|cltt|tstp)\s+(?:\d\s+(\d{4}/\d{2}/\d{2}\s+\d{2}:\d{2}:\d{2})|epoch\s+(\d+))")
+
+NETSTATE_COLUMNS = ["last_seen_ip", "last_seen_mac", "last_seen_at", "lease_state", "lease_ends"]
+
+def open_log(path: str):
+    """Open a log for line-by-line text reading, transparently decompressing .gz files."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+def _parse_lease_time(match) -> Optional[datetime]:
+    if match.group(3):
+        return datetime.fromtimestamp(int(match.group(3)), tz=timezone.utc)
+    return datetime.strptime(match.group(2), "%Y/%m/%d %H:%M:%S").replace(tzinfo=timezone.utc)
+
+def iter_dhcp_leases(path: str) -> Iterator[Dict]:
+    """
+    Stream the lease blocks of an ISC dhcpd leases file:
+      {"ip", "mac", "time", "lease_state", "lease_ends"}
+    time is the most recent of cltt/starts; blocks without a hardware address are skipped.
+    """
+    lease = None
+    with open_log(path) as f:
+        for line in f:
+            line = line.strip()
+            if lease is None:
+                match = LEASE_START_RE.match(line)
+                if match:
+                    lease = {"ip": match.group(1), "mac": None, "time": None, "lease_state": None, "lease_ends": None}
+                continue
+            if line.startswith("}"):
+                if lease["mac"]:
+                    yield lease
+                lease = None
+                continue
+            match = LEASE_TIME_RE.match(line)
+            if match:
+                kind = match.group(1)
+                if kind == "ends":
+                    lease["lease_ends"] = _parse_lease_time(match)
+                elif kind in ("starts", "cltt"):
+                    when = _parse_lease_time(match)
+                    if lease["time"] is None or when > lease["time"]:
+                        lease["time"] = when
+            elif line.startswith("hardware ethernet"):
+                lease["mac"] = line[len("hardware ethernet"):].strip().rstrip(";")
+            elif line.startswith("binding state"):
+                lease["lease_state"] = line[len("binding state"):].strip().rstrip(";")
+
+def iter_arp_entries(path: str, observed_at: Optional[datetime] = None) -> Iterator[Dict]:
+    """
+    Stream IP/MAC pairs from an ARP or neighbor dump (`ip neigh`, `arp -an` or /proc/net/arp).
+    Dumps carry no timestamps, so entries are undated unless observed_at (when the dump was
+    taken) is given; file metadata such as the modification time is not used, since copying
+    or re-compressing a dump would change the result.
+    """
+    with open_log(path) as f:
+        for line in f:
+            ip_match = IPV4_RE.search(line)
+            mac_match = MAC_RE.search(line)
+            if not ip_match or not mac_match:
+                continue
+            # Incomplete entries in /proc/net/arp have an all-zero hardware address
+            if mac_match.group(0).replace("0", "").replace(":", "") == "":
+                continue
+            yield {"ip": ip_match.group(0), "mac": mac_match.group(0), "time": observed_at, "lease_state": None, "lease_ends": None}
+
+def _canonical(ip: str, mac: str) -> Tuple[Optional[str], Optional[str]]:
+    ip, ip_label = validate_and_label_ipv4(ip.strip())
+    # Single-digit groups (arp may print "0:1b:...") are padded before validation
+    mac = ":".join(part.zfill(2) for part in mac.strip().split(":"))
+    mac, mac_label = validate_and_label_mac(mac)
+    return (ip if ip_label == "ok" else None), (mac if mac_label == "ok" else None)
+
+def _newer(observation: Dict, current: Optional[Dict]) -> bool:
+    # Later lines win ties, so the order of the logs decides between undated observations
+    if current is None or current["time"] is None:
+        return True
+    return observation["time"] is not None and observation["time"] >= current["time"]
+
+class NetworkStateIndex:
+    """
+    Hash indexes on the clean inventory's valid IPs and MACs, holding only the latest
+    observation per indexed key, so memory is bounded by the inventory rather than the logs.
+    """
+
+    def __init__(self, clean_df: pd.DataFrame):
+        self.ips = set(clean_df.loc[is_true_flag(clean_df["ip_valid"]), "ip"].dropna())
+        self.macs = set(clean_df.loc[is_true_flag(clean_df["mac_valid"]), "mac"].dropna())
+        self.ip_seen: Dict[str, Dict] = {}
+        self.mac_seen: Dict[str, Dict] = {}
+        self.ip_lease: Dict[str, Dict] = {}
+        self.mac_lease: Dict[str, Dict] = {}
+        self.observations = 0
+        self.matched = 0
+        self.newest: Optional[datetime] = None
+
+    def observe(self, observation: Dict) -> None:
+        self.observations += 1
+        ip, mac = _canonical(observation["ip"], observation["mac"])
+        if ip is None or mac is None:
+            return
+        observation = {**observation, "ip": ip, "mac": mac}
+        if observation["time"] is not None and (self.newest is None or observation["time"] > self.newest):
+            self.newest = observation["time"]
+        is_lease = observation["lease_state"] is not None or observation["lease_ends"] is not None
+        matched = False
+        if ip in self.ips:
+            matched = True
+            if _newer(observation, self.ip_seen.get(ip)):
+                self.ip_seen[ip] = observation
+            if is_lease and _newer(observation, self.ip_lease.get(ip)):
+                self.ip_lease[ip] = observation
+        if mac in self.macs:
+            matched = True
+            if _newer(observation, self.mac_seen.get(mac)):
+                self.mac_seen[mac] = observation
+            if is_lease and _newer(observation, self.mac_lease.get(mac)):
+                self.mac_lease[mac] = observation
+        self.matched += matched
+
+    def stats(self) -> Dict:
+        return {"netstate_observations": self.observations, "netstate_matched_observations": self.matched}
+
+def _iso(when: Optional[datetime]) -> str:
+    return when.isoformat() if when is not None else ""
+
+def correlate_network_state(
+    clean_df: pd.DataFrame,
+    dhcp_lease_files: List[str],
+    arp_dump_files: List[str],
+    stale_days: float = 30,
+    arp_observed_at: Optional[datetime] = None,
+) -> Tuple[pd.DataFrame, List[Dict], Dict]:
+    """
+    Stream DHCP lease files and ARP dumps against the clean inventory (indexed by source_row_id).
+
+    Returns the inventory with last_seen_ip (latest IP seen for the record's MAC), last_seen_mac
+    (latest MAC seen on the record's IP), last_seen_at, lease_state and lease_ends added, the
+    mismatch/stale anomaly records, and observation counts.
+    Staleness is measured against the newest dated observation in the logs rather than the wall
+    clock, so re-running on the same dumps gives the same result. ARP entries are dated with
+    arp_observed_at, or left undated (not counted towards the newest observation) without it.
+    """
+    index = NetworkStateIndex(clean_df)
+    for path in dhcp_lease_files:
+        for lease in iter_dhcp_leases(path):
+            index.observe(lease)
+    for path in arp_dump_files:
+        for entry in iter_arp_entries(path, observed_at=arp_observed_at):
+            index.observe(entry)
+
+    stale_before = index.newest - timedelta(days=stale_days) if index.newest is not None else None
+    ip_valid = is_true_flag(clean_df["ip_valid"])
+    mac_valid = is_true_flag(clean_df["mac_valid"])
+    columns = {column: [] for column in NETSTATE_COLUMNS}
+    anomalies = []
+    for position, (source_row_id, row) in enumerate(clean_df.iterrows()):
+        ip = row["ip"] if ip_valid.iloc[position] else None
+        mac = row["mac"] if mac_valid.iloc[position] else None
+        ip_obs = index.ip_seen.get(ip) if ip else None
+        mac_obs = index.mac_seen.get(mac) if mac else None
+        lease = index.ip_lease.get(ip) if ip else None
+        mac_lease = index.mac_lease.get(mac) if mac else None
+        if mac_lease is not None and _newer(mac_lease, lease):
+            lease = mac_lease
+        times = [obs["time"] for obs in (ip_obs, mac_obs) if obs is not None and obs["time"] is not None]
+        last_seen_at = max(times) if times else None
+
+        columns["last_seen_ip"].append(mac_obs["ip"] if mac_obs else "")
+        columns["last_seen_mac"].append(ip_obs["mac"] if ip_obs else "")
+        columns["last_seen_at"].append(_iso(last_seen_at))
+        columns["lease_state"].append((lease["lease_state"] or "") if lease else "")
+        columns["lease_ends"].append(_iso(lease["lease_ends"]) if lease else "")
+
+        issues = []
+        recommended_actions = []
+        if ip and mac and ip_obs and ip_obs["mac"] != mac:
+            issues.append({"field": "ip", "type": "ip_seen_with_other_mac", "value": ip_obs["mac"]})
+            recommended_actions.append("Verify the MAC for this IP; the network last saw it on a different MAC")
+        if mac and mac_obs and mac_obs["ip"] != ip:
+            issues.append({"field": "mac", "type": "mac_seen_on_other_ip", "value": mac_obs["ip"]})
+            recommended_actions.append("Update the IP from the observed lease/ARP data or verify the record")
+        if (ip or mac) and not ip_obs and not mac_obs:
+            issues.append({"field": "ip" if ip else "mac", "type": "not_observed", "value": ip or mac})
+            recommended_actions.append("Confirm the device still exists; it was not seen in DHCP or ARP logs")
+        elif stale_before is not None and last_seen_at is not None and last_seen_at < stale_before:
+            issues.append({"field": "ip" if ip else "mac", "type": "stale_observation", "value": _iso(last_seen_at)})
+            recommended_actions.append(f"Confirm the device is still in use; last seen more than {stale_days:g} days before the newest log entry")
+        lease_inactive = lease is not None and lease["lease_state"] not in (None, "active")
+        lease_lapsed = lease is not None and lease["lease_ends"] is not None and index.newest is not None and lease["lease_ends"] < index.newest
+        if lease_inactive or lease_lapsed:
+            # An inactive state explains itself; an "active" lease that has run out is reported by its end time
+            value = lease["lease_state"] if lease_inactive else _iso(lease["lease_ends"])
+            issues.append({"field": "ip" if ip else "mac", "type": "lease_expired", "value": value})
+            recommended_actions.append("Reclaim or renew the expired DHCP lease")
+        if issues:
+            anomalies.append({"source_row_id": source_row_id, "issues": issues, "recommended_actions": recommended_actions})
+
+    correlated_df = clean_df.copy()
+    for column, values in columns.items():
+        correlated_df[column] = values
+    return correlated_df, anomalies, index.stats()
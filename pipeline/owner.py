@@ -1,6 +1,24 @@
-from pipeline.llm import GPTClient
-from typing import Dict
+from pipeline.llm import GPTClient, LLMResponseError, TokenBudgetExceeded
+from typing import Dict, List
 
+OWNER_SCHEMA = {
+    "name": "owner",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "owner_out": {"type": "string"},
+            # Empty when the input carries no email
+            "owner_email": {"type": "string", "pattern": "^$|^[^@\\s]+@[^@\\s]+\\.[^@\\s]+$"},
+            "owner_team": {"type": "string"},
+        },
+        "required": ["owner_out", "owner_email", "owner_team"],
+        "additionalProperties": False,
+    },
+}
+
+# Other names the model uses for OWNER_SCHEMA fields; needed where "name" or "type" is ambiguous (fused stage)
+OWNER_KEY_ALIASES = {"name": "owner_out", "full_name": "owner_out"}
 
 def trim_owner_str(owner: str) -> str:
     try:
@@ -8,14 +26,53 @@ def trim_owner_str(owner: str) -> str:
     except Exception:
         return ""
     
+def owner_needs_llm(owner: str) -> bool:
+    """
+    Deterministic tier: an empty owner has nothing to extract.
+    """
+    return isinstance(owner, str) and owner.strip() != ""
+
 def process_owner(owner: str, llm: GPTClient, owner_prompt: str, system_prompt: str) -> Dict:
     steps = []
     notes = []
     trimmed_owner = trim_owner_str(owner)
     steps.append("owner_trim")
-    owner_prompt_augmented = owner_prompt + trimmed_owner
-    owner = llm.generate(system_prompt, owner_prompt_augmented)
+    if not owner_needs_llm(owner):
+        steps.append("owner_skipped_empty_input")
+        return build_owner_result({field: "" for field in OWNER_SCHEMA["schema"]["required"]}, steps)
+    try:
+        owner = llm.generate(system_prompt + owner_prompt, trimmed_owner, schema=OWNER_SCHEMA, key_aliases=OWNER_KEY_ALIASES)
+    except TokenBudgetExceeded:
+        return owner_budget_exhausted_result(steps)
+    except LLMResponseError:
+        return owner_invalid_response_result(steps)
     steps.append("owner_parse")
+    return build_owner_result(owner, steps)
+
+def owner_budget_exhausted_result(steps: List[str]) -> Dict:
+    steps.append("owner_skipped_token_budget_exhausted")
+    return {
+        **{field: "" for field in OWNER_SCHEMA["schema"]["required"]},
+        "owner_issues": "Token budget exhausted",
+        "owner_recommended_action": "Re-run owner normalization with a larger token budget",
+        "owner_normalization_steps": "|".join(steps)
+    }
+
+def owner_invalid_response_result(steps: List[str]) -> Dict:
+    steps.append("owner_invalid_llm_response")
+    return {
+        **{field: "" for field in OWNER_SCHEMA["schema"]["required"]},
+        "owner_issues": "Unparseable LLM response",
+        "owner_recommended_action": "Re-run owner normalization or correct owner manually",
+        "owner_normalization_steps": "|".join(steps)
+    }
+
+def build_owner_result(owner: Dict, steps: List[str]) -> Dict:
+    """
+    Add the owner issue, recommended action and normalization steps to the parsed owner fields.
+    """
+    # Only the schema's fields are kept, and a missing field counts as empty
+    owner = {field: owner.get(field, "") for field in OWNER_SCHEMA["schema"]["required"]}
     if any(v == "" for v in owner.values()):
         owner_issues = "Missing owner fields"
         owner_recommended_action = "Correct owner or mark record for revision"
@@ -28,4 +85,17 @@ def process_owner(owner: str, llm: GPTClient, owner_prompt: str, system_prompt:
         "owner_issues": owner_issues,
         "owner_recommended_action": owner_recommended_action,
         "owner_normalization_steps": "|".join(steps)
+    }
+
+def skip_owner(owner: str) -> Dict:
+    """
+    Result used when the LLM stages are disabled (--no-llm): the trimmed input is kept as
+    owner_out, the remaining fields are left empty and the record is flagged as skipped.
+    """
+    return {
+        **{field: "" for field in OWNER_SCHEMA["schema"]["required"]},
+        "owner_out": trim_owner_str(owner) if isinstance(owner, str) else "",
+        "owner_issues": "Skipped (LLM stages disabled)",
+        "owner_recommended_action": "Re-run without --no-llm to normalize owner",
+        "owner_normalization_steps": "owner_skipped_no_llm"
     }
\ No newline at end of file
@@ -0,0 +1,73 @@
+from pipeline.device import (
+    DEVICE_KEY_ALIASES,
+    DEVICE_SCHEMA,
+    build_device_result,
+    device_budget_exhausted_result,
+    device_invalid_response_result,
+    device_needs_llm,
+    device_prompt_data,
+    process_device,
+)
+from pipeline.llm import GPTClient, LLMResponseError, TokenBudgetExceeded
+from pipeline.owner import (
+    OWNER_KEY_ALIASES,
+    OWNER_SCHEMA,
+    build_owner_result,
+    owner_budget_exhausted_result,
+    owner_invalid_response_result,
+    owner_needs_llm,
+    process_owner,
+    trim_owner_str,
+)
+from typing import Dict
+
+OWNER_FIELDS = OWNER_SCHEMA["schema"]["required"]
+DEVICE_FIELDS = DEVICE_SCHEMA["schema"]["required"]
+
+OWNER_DEVICE_SCHEMA = {
+    "name": "owner_device",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            **OWNER_SCHEMA["schema"]["properties"],
+            **DEVICE_SCHEMA["schema"]["properties"],
+        },
+        "required": OWNER_FIELDS + DEVICE_FIELDS,
+        "additionalProperties": False,
+    },
+}
+
+def process_owner_device(owner: str, device: str, hostname: str, notes: str, llm: GPTClient, owner_device_prompt: str, owner_prompt: str, device_prompt: str, system_prompt: str) -> Dict:
+    """
+    Fused owner + device stage: rows that need both LLM extractions get a single request
+    returning all owner and device fields, which is split back into the usual owner_* and
+    device_* columns. Rows that need only one of them fall back to that stage alone, and rows
+    that need neither never reach the LLM.
+    """
+    if not (owner_needs_llm(owner) and device_needs_llm(device, hostname, notes)):
+        return {
+            **process_owner(owner, llm, owner_prompt=owner_prompt, system_prompt=system_prompt),
+            **process_device(device, hostname, notes, llm, device_prompt=device_prompt, system_prompt=system_prompt),
+        }
+
+    owner_steps = ["owner_trim"]
+    device_steps = ["device_trim"]
+    prompt = f"Owner: {trim_owner_str(owner)} {device_prompt_data(device, hostname, notes)}"
+    try:
+        combined = llm.generate(
+            system_prompt + owner_device_prompt,
+            prompt,
+            schema=OWNER_DEVICE_SCHEMA,
+            key_aliases={**OWNER_KEY_ALIASES, **DEVICE_KEY_ALIASES},
+        )
+    except TokenBudgetExceeded:
+        return {**owner_budget_exhausted_result(owner_steps), **device_budget_exhausted_result(device_steps)}
+    except LLMResponseError:
+        return {**owner_invalid_response_result(owner_steps), **device_invalid_response_result(device_steps)}
+    owner_steps.append("owner_parse_fused")
+    device_steps.append("device_parse_fused")
+    return {
+        **build_owner_result(combined, owner_steps),
+        **build_device_result(combined, device_steps),
+    }
@@ -0,0 +1,82 @@
+import json
+import zlib
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from pipeline.checkpoint import atomic_write_json
+from pipeline.storage import CLEAN_SCHEMA, read_table
+
+DONE_MARKER = "_SUCCESS"
+
+def shard_of(source_row_id, shards: int) -> int:
+    """
+    Stable shard assignment: CRC32 of the row id's string form, so every host and
+    process agrees regardless of Python's per-process hash seed.
+    """
+    return zlib.crc32(str(source_row_id).encode("utf-8")) % shards
+
+def select_shard(raw_data: pd.DataFrame, shards: int, shard_index: int) -> pd.DataFrame:
+    """Rows of raw_data (indexed by source_row_id) that belong to shard_index."""
+    mask = [shard_of(source_row_id, shards) == shard_index for source_row_id in raw_data.index]
+    return raw_data[mask]
+
+def shard_output_dir(shard_dir: str, shard_index: int) -> Path:
+    return Path(shard_dir) / f"shard-{shard_index:05d}"
+
+def write_shard_done(out_dir: Path, shards: int, shard_index: int, clean_file: str) -> None:
+    """Written last, so a merge never picks up a shard whose outputs are incomplete."""
+    atomic_write_json(out_dir / DONE_MARKER, {"shards": shards, "shard_index": shard_index, "clean_file": clean_file})
+
+def _merge_metrics(shard_metrics: List[Dict]) -> Dict:
+    # Counters (including nested counter dicts such as repairs) add up across shards;
+    # anything else (flags, budgets) is taken from the first shard
+    merged: Dict = {}
+    for metrics in shard_metrics:
+        for key, value in metrics.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and key != "token_budget":
+                merged[key] = merged.get(key, 0) + value
+            elif isinstance(value, dict):
+                merged[key] = _merge_metrics([merged.get(key, {}), value])
+            else:
+                merged.setdefault(key, value)
+    return merged
+
+def merge_shards(shard_dir: str, shards: int) -> Tuple[pd.DataFrame, List[Dict], Dict]:
+    """
+    Combine the clean inventory, anomalies and metrics of every shard under shard_dir.
+    Rows and anomalies are ordered by source_row_id, so the result does not depend on
+    which host finished first. Raises FileNotFoundError if any shard has not completed.
+    """
+    done = []
+    missing = []
+    for shard_index in range(shards):
+        marker = shard_output_dir(shard_dir, shard_index) / DONE_MARKER
+        if marker.exists():
+            with open(marker, encoding="utf-8") as f:
+                done.append(json.load(f))
+        else:
+            missing.append(shard_index)
+    if missing:
+        raise FileNotFoundError(f"Shards not completed in {shard_dir}: {', '.join(str(i) for i in missing)}")
+
+    clean_parts = []
+    anomalies: List[Dict] = []
+    shard_metrics = []
+    for marker in done:
+        if marker["shards"] != shards:
+            raise ValueError(f"Shard {marker['shard_index']} in {shard_dir} was produced for {marker['shards']} shards, not {shards}")
+        out_dir = shard_output_dir(shard_dir, marker["shard_index"])
+        # CSV shards are read as text so values such as "10.0" or "nan" come back exactly as written
+        clean_table = read_table(str(out_dir / marker["clean_file"]), text_columns=list(CLEAN_SCHEMA))
+        clean_parts.append(clean_table.set_index("source_row_id"))
+        with open(out_dir / "anomalies.json", encoding="utf-8") as f:
+            anomalies.extend(json.load(f))
+        with open(out_dir / "metrics.json", encoding="utf-8") as f:
+            shard_metrics.append(json.load(f))
+
+    clean_df = pd.concat(clean_parts).sort_index(kind="stable")
+    anomalies.sort(key=lambda record: record["source_row_id"])
+    metrics = {**_merge_metrics(shard_metrics), "shards": shards}
+    return clean_df, anomalies, metrics
@@ -1,5 +1,20 @@
 import re
 
+# Mapping of common abbreviations to full forms, compiled once at import
+SITE_REPLACEMENTS = [
+    (re.compile(pattern, flags=re.IGNORECASE), full)
+    for pattern, full in {
+        r"\bBldg\b": "Building",
+        r"\bBLR\b": "Bangalore",
+        r"\bDC\b": "Datacenter",
+        r"\bHQ\b": "Headquarters",
+        r"\bLab\b": "Laboratory",
+        r"\bCampus\b": "Campus",  # keep capitalization consistent
+    }.items()
+]
+WHITESPACE_RE = re.compile(r"[ _]+")
+DUPLICATE_HYPHENS_RE = re.compile(r"-{2,}")
+
 def normalize_site_name(name: str) -> str:
     steps = []
     if not name or not isinstance(name, str):
@@ -8,29 +23,19 @@ def normalize_site_name(name: str) -> str:
             "site_normalization_steps": "site_invalid_missing_site"
         }
 
-    # Mapping of common abbreviations to full forms
-    replacements = {
-        r"\bBldg\b": "Building",
-        r"\bBLR\b": "Bangalore",
-        r"\bDC\b": "Datacenter",
-        r"\bHQ\b": "Headquarters",
-        r"\bLab\b": "Laboratory",
-        r"\bCampus\b": "Campus",  # keep capitalization consistent
-    }
-
     s = name.strip()
 
     # Apply replacements (case-insensitive)
-    for pattern, full in replacements.items():
-        s = re.sub(pattern, full, s, flags=re.IGNORECASE)
+    for pattern, full in SITE_REPLACEMENTS:
+        s = pattern.sub(full, s)
 
     steps.append("site_replace_common_abbreviations")
     # Replace spaces/underscores with hyphens
-    s = re.sub(r"[ _]+", "-", s)
+    s = WHITESPACE_RE.sub("-", s)
     steps.append("site_replace_common_abbreviations")
     
     # Remove duplicate hyphens
-    s = re.sub(r"-{2,}", "-", s)
+    s = DUPLICATE_HYPHENS_RE.sub("-", s)
     steps.append("site_replace_whitespace_with_hypen")
 
     # Normalize capitalization (title case or upper depending on your style)
@@ -0,0 +1,146 @@
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Declared schema of the clean inventory (source_row_id is the index)
+CLEAN_SCHEMA: Dict[str, str] = {
+    "notes": "string",
+    "ip": "string",
+    "ip_valid": "boolean",
+    "ip_version": "uint8",
+    "ip_reverse_ptr": "string",
+    "ip_classification": "category",
+    "subnet_cidr": "string",
+    "mac": "string",
+    "mac_valid": "boolean",
+    "mac_kind": "category",
+    "site": "category",
+    "hostname": "string",
+    "hostname_valid": "boolean",
+    "hostname_kind": "category",
+    "fqdn": "string",
+    "fqdn_valid": "boolean",
+    "fqdn_kind": "category",
+    "owner": "string",
+    "owner_email": "string",
+    "owner_team": "category",
+    "device": "category",
+    "device_type_confidence": "category",
+    # Added when DHCP lease / ARP logs are correlated against the inventory
+    "last_seen_ip": "string",
+    "last_seen_mac": "string",
+    "last_seen_at": "string",
+    "lease_state": "category",
+    "lease_ends": "string",
+}
+
+PARQUET_SUFFIXES = (".parquet", ".pq")
+ARROW_SUFFIXES = (".arrow", ".feather", ".ipc")
+
+def table_format(path: str) -> str:
+    """
+    Return 'csv', 'parquet' or 'arrow' based on the file extension.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix in PARQUET_SUFFIXES:
+        return "parquet"
+    if suffix in ARROW_SUFFIXES:
+        return "arrow"
+    return "csv"
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("pyarrow is required for Parquet/Arrow files (pip install pyarrow)") from e
+    return pyarrow
+
+def _to_bool(value) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if pd.isna(value) or str(value).strip() == "":
+        return None
+    return str(value).strip().lower() == "true"
+
+def apply_clean_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cast the clean inventory to its declared dtypes:
+      - boolean flags from "True"/"False" strings to nullable booleans
+      - ip_version to nullable uint8
+      - low-cardinality fields to categoricals (dictionary-encoded in Parquet/Arrow)
+    Empty strings become missing values in typed columns.
+    """
+    typed = df.copy()
+    for col, dtype in CLEAN_SCHEMA.items():
+        if col not in typed.columns:
+            continue
+        values = typed[col]
+        if dtype == "boolean":
+            typed[col] = values.map(_to_bool).astype("boolean")
+        elif dtype == "uint8":
+            typed[col] = pd.to_numeric(values.mask(values == ""), errors="coerce").astype("UInt8")
+        elif dtype == "category":
+            typed[col] = values.mask(values == "").astype("string").astype("category")
+        else:
+            typed[col] = values.astype("string")
+    return typed
+
+def clean_arrow_schema(columns: List[str], index_name: str = "source_row_id", index_type=None):
+    """
+    Arrow schema for the given clean inventory columns, index first.
+    index_type is the Arrow type of source_row_id (int64 unless given), since row ids may be strings.
+    """
+    pa = _require_pyarrow()
+    if index_type is None:
+        index_type = pa.int64()
+    arrow_types = {
+        "string": pa.string(),
+        "boolean": pa.bool_(),
+        "uint8": pa.uint8(),
+        "category": pa.dictionary(pa.int32(), pa.string()),
+    }
+    fields = [pa.field(index_name, index_type, nullable=False)]
+    for col in columns:
+        fields.append(pa.field(col, arrow_types[CLEAN_SCHEMA.get(col, "string")]))
+    return pa.schema(fields)
+
+def read_table(path: str, columns: Optional[List[str]] = None, text_columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Read a CSV, Parquet or Arrow IPC (Feather v2) file; only the requested columns are loaded.
+    For CSV, text_columns are read verbatim (no number or NaN inference); Parquet/Arrow carry their own types.
+    """
+    fmt = table_format(path)
+    if fmt == "parquet":
+        _require_pyarrow()
+        return pd.read_parquet(path, columns=columns)
+    if fmt == "arrow":
+        _require_pyarrow()
+        return pd.read_feather(path, columns=columns)
+    if text_columns:
+        return pd.read_csv(path, usecols=columns, dtype={col: str for col in text_columns}, keep_default_na=False)
+    return pd.read_csv(path, usecols=columns)
+
+def write_clean_table(df: pd.DataFrame, path: str) -> None:
+    """
+    Write the clean inventory with its declared schema. The format follows the extension;
+    source_row_id is written as a regular leading column in every format.
+    """
+    typed = apply_clean_schema(df)
+    fmt = table_format(path)
+    if fmt == "csv":
+        typed.to_csv(path, index=True)
+        return
+
+    _require_pyarrow()
+    import pyarrow as pa
+    index_name = typed.index.name or "source_row_id"
+    # The index type follows the input's row ids (integers, or strings such as "R-1")
+    index_type = pa.Schema.from_pandas(typed.index.to_frame(index=False, name=index_name), preserve_index=False).field(index_name).type
+    schema = clean_arrow_schema(list(typed.columns), index_name, index_type)
+    table = pa.Table.from_pandas(typed.reset_index(names=index_name), schema=schema, preserve_index=False)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(table, path, compression="zstd")
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table, path, compression="zstd")
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+# A transport takes a chat completion request (model, messages, temperature, response_format,
+# max_tokens) and returns {"content": str, "usage": {"prompt_tokens", "completion_tokens", "cached_tokens"}}.
+# GPTClient handles prompts, budgets and caching on top of it.
+
+TRANSPORT_MODES = ("openai", "record", "replay", "fake")
+
+class ReplayMiss(LookupError):
+    """Raised when a replayed run sends a request that is not in the fixture file."""
+
+def request_key(request: Dict) -> str:
+    """Stable identifier of a request, independent of dict ordering."""
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class OpenAITransport:
+    """Sends requests to the OpenAI API. The client and its imports are created on first use."""
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from openai import OpenAI
+                from dotenv import load_dotenv
+
+                # Load environment variables from .env
+                load_dotenv()
+                api_key = os.getenv("OPENAI_API_KEY")
+                if not api_key:
+                    raise ValueError("OPENAI_API_KEY not found in .env")
+
+                # Initialize the OpenAI client
+                self._client = OpenAI(api_key=api_key)
+            return self._client
+
+    def complete(self, request: Dict) -> Dict:
+        response = self.client.chat.completions.create(**request)
+        usage = getattr(response, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None) if usage is not None else None
+        return {
+            "content": response.choices[0].message.content,
+            "usage": {
+                "prompt_tokens": (usage.prompt_tokens or 0) if usage is not None else 0,
+                "completion_tokens": (usage.completion_tokens or 0) if usage is not None else 0,
+                "cached_tokens": (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0,
+            },
+        }
+
+class RecordingTransport:
+    """Passes requests to another transport and appends each request/response pair to a JSONL fixture."""
+
+    def __init__(self, inner, fixture_path: str):
+        self.inner = inner
+        self.fixture_path = fixture_path
+        self._lock = threading.Lock()
+
+    def complete(self, request: Dict) -> Dict:
+        start = time.perf_counter()
+        response = self.inner.complete(request)
+        entry = {
+            "key": request_key(request),
+            "request": request,
+            "response": response,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+        with self._lock:
+            with open(self.fixture_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return response
+
+class ReplayTransport:
+    """
+    Serves responses from a fixture written by RecordingTransport, without network access.
+    Each request waits latency_ms, or the latency observed when it was recorded if latency_ms is None.
+    """
+
+    def __init__(self, fixture_path: str, latency_ms: Optional[float] = None):
+        self.fixture_path = fixture_path
+        self.latency_ms = latency_ms
+        self._entries: Dict[str, Dict] = {}
+        with open(fixture_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]] = entry
+
+    def complete(self, request: Dict) -> Dict:
+        entry = self._entries.get(request_key(request))
+        if entry is None:
+            raise ReplayMiss(f"Request not recorded in {self.fixture_path}; re-record with --llm-transport record")
+        latency_ms = entry.get("latency_ms", 0) if self.latency_ms is None else self.latency_ms
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+        return entry["response"]
+
+class FakeTransport:
+    """
+    Returns deterministic synthetic answers that satisfy the request's JSON schema.
+    The same request always gets the same answer; usage is estimated with the local tokenizer.
+    """
+
+    def __init__(self, latency_ms: Optional[float] = None):
+        self.latency_ms = latency_ms or 0
+
+    @staticmethod
+    def _fake_value(name: str, spec: Dict, seed: str) -> str:
+        digest = hashlib.sha256(f"{seed}:{name}".encode("utf-8")).hexdigest()
+        choices = [choice for choice in spec.get("enum", []) if choice != ""]
+        if choices:
+            return choices[int(digest, 16) % len(choices)]
+        if "email" in name:
+            return f"user-{digest[:6]}@example.com"
+        return f"{name.rsplit('_out', 1)[0]}-{digest[:6]}"
+
+    def complete(self, request: Dict) -> Dict:
+        from pipeline.llm import count_tokens, estimate_prompt_tokens
+
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        seed = request_key(request)
+        json_schema = request.get("response_format", {}).get("json_schema")
+        schema = (json_schema or {}).get("schema", {})
+        answer = {
+            name: self._fake_value(name, spec, seed)
+            for name, spec in schema.get("properties", {}).items()
+        }
+        content = json.dumps(answer)
+        model = request.get("model", "gpt-4o-mini")
+        return {
+            "content": content,
+            "usage": {
+                "prompt_tokens": estimate_prompt_tokens(request["messages"], json_schema, model),
+                "completion_tokens": count_tokens(content, model),
+                "cached_tokens": 0,
+            },
+        }
+
+def make_transport(mode: str = "openai", fixture_path: Optional[str] = None, latency_ms: Optional[float] = None):
+    """
+    Build the transport for a run:
+      - openai: live API
+      - record: live API, capturing every request/response to fixture_path
+      - replay: serve fixture_path offline with synthetic latency
+      - fake:   deterministic synthetic answers, no fixture needed
+    """
+    if mode == "openai":
+        return OpenAITransport()
+    if mode == "record":
+        return RecordingTransport(OpenAITransport(), fixture_path)
+    if mode == "replay":
+        return ReplayTransport(fixture_path, latency_ms=latency_ms)
+    if mode == "fake":
+        return FakeTransport(latency_ms=latency_ms)
+    raise ValueError(f"Unknown LLM transport {mode!r}; expected one of {', '.join(TRANSPORT_MODES)}")
@@ -1,63 +1,97 @@
-import pandas as pd
+from __future__ import annotations
+import argparse
+import hashlib
 import json
-from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional
 from pipeline.ip import process_ipv4
 from pipeline.hostname_fqdn import process_hostname, process_fqdn
 from pipeline.site import normalize_site_name
 from pipeline.mac import process_mac
-from pipeline.device import process_device
-from pipeline.owner import process_owner
+from pipeline.device import DEVICE_SCHEMA, process_device, skip_device
+from pipeline.owner import OWNER_SCHEMA, process_owner, skip_owner
+from pipeline.owner_device import OWNER_DEVICE_SCHEMA, process_owner_device
 from pipeline.llm import GPTClient
+from pipeline.transport import TRANSPORT_MODES, make_transport
 
-system_prompt = '''
-You specialize in network analytics
-'''
-device_prompt = '''
-Given the following string, I want you to parse it to extract:
-- Device Type (based on Hostname and Device Type and Notes)
-- Confidence score (low, high, mid) based on your classification, be very critical of this
-
-I want you to return the response to me in a JSON format containing:
-- device_out
-- device_type_confidence
-
-I want only the JSON and nothing else
-
-Wherever impossible to do so, return empty strings within the JSON fields
+# pandas (and pyarrow/openai further down) are imported where they are used, so that
+# importing this module and `run.py --help` stay fast for short-lived jobs
+if TYPE_CHECKING:
+    import pandas as pd
+    from pipeline.checkpoint import CheckpointStore
 
-String:
+# Static instructions live in the system message so every request of a stage shares
+# an identical prefix; rows only add the user message. The prefix (~60-100 tokens) is well
+# below the provider's 1024-token minimum for prompt caching, so cached_prompt_tokens stays 0;
+# the savings come from the short prompts and the local response cache instead.
+system_prompt = '''You specialize in network analytics.
+'''
+device_prompt = '''Classify the device described by the user's Hostname, Device Type and Notes.
+- device_out: short lowercase device type (e.g. server, switch, router, firewall, printer, access point)
+- device_type_confidence: low, mid or high; be very critical
+Use "" for any field that cannot be determined.
+'''
+owner_prompt = '''Extract the owner from the user's string.
+- owner_out: capitalized owner name (may be derived from the email address)
+- owner_email: email address
+- owner_team: team name
+Use "" for any field that cannot be determined.
+'''
+owner_device_prompt = '''Extract the owner from the user's Owner string and classify the device described by the Hostname, Device Type and Notes.
+- owner_out: capitalized owner name (may be derived from the email address)
+- owner_email: email address
+- owner_team: team name
+- device_out: short lowercase device type (e.g. server, switch, router, firewall, printer, access point)
+- device_type_confidence: low, mid or high; be very critical
+Use "" for any field that cannot be determined.
 '''
-owner_prompt = '''
-Given the following string, I want you to parse it to extract:
-- An email address
-- A name
-- A team name
-
-I want you to return the response to me in a JSON format containing:
-- owner_out (Capitalize owner name if possible, may be possible to obtain from email address too)
-- owner_email
-- owner_team
 
-I want only the JSON and nothing else
+def apply_rows(df: pd.DataFrame, func, input_cols: list[str], workers: int = 1, **kwargs) -> pd.DataFrame:
+    import pandas as pd
 
-Wherever impossible to do so, return empty strings within the JSON fields
+    if workers > 1:
+        # Fan rows out over threads; used for the LLM stages, which are bound by request latency
+        rows = df[input_cols].itertuples(index=False, name=None)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda row: func(*row, **kwargs), rows))
+        result_df = pd.DataFrame(results, index=df.index)
+    else:
+        # Apply the function row-wise, passing in the specified columns
+        result_df = (
+            df[input_cols]
+            .apply(lambda row: func(*row, **kwargs), axis=1)
+            .apply(pd.Series)
+        )
+    return result_df
 
-String:
-'''
+def apply_and_expand(df: pd.DataFrame, func, input_cols: list[str], workers: int = 1, checkpoint: Optional[CheckpointStore] = None, **kwargs) -> pd.DataFrame:
+    import pandas as pd
 
-def apply_and_expand(df: pd.DataFrame, func, input_cols: list[str], **kwargs) -> pd.DataFrame:
-    
-    # Apply the function row-wise, passing in the specified columns
-    result_df = (
-        df[input_cols]
-        .apply(lambda row: func(*row, **kwargs), axis=1)
-        .apply(pd.Series)
-    )
+    if checkpoint is None:
+        result_df = apply_rows(df, func, input_cols, workers=workers, **kwargs)
+    else:
+        # Work through the stage in chunks, reusing chunks completed by an earlier attempt
+        llm = kwargs.get("llm")
+        chunk_results = []
+        for chunk_index, start in enumerate(range(0, len(df), checkpoint.chunk_size)):
+            rows_df = df.iloc[start:start + checkpoint.chunk_size]
+            chunk_df = checkpoint.load(func.__name__, chunk_index, expected_index=rows_df.index)
+            if chunk_df is None:
+                unfinished_before = (llm.budget_rejections, llm.failed_responses) if llm else None
+                chunk_df = apply_rows(rows_df, func, input_cols, workers=workers, **kwargs)
+                # Rows skipped for lack of token budget or left without a valid LLM reply are
+                # unfinished, so the chunk is not saved and a resumed run retries them
+                if not llm or (llm.budget_rejections, llm.failed_responses) == unfinished_before:
+                    checkpoint.save(func.__name__, chunk_index, chunk_df)
+            chunk_results.append(chunk_df)
+        result_df = pd.concat(chunk_results) if chunk_results else apply_rows(df, func, input_cols, workers=workers, **kwargs)
 
     # Join results back to the original DataFrame
     return df.join(result_df)
 
 def collect_anomalies(df: pd.DataFrame) -> List[Dict]:
+    import pandas as pd
+
     anomaly_records = []
     for _, row in df.iterrows():
         source_row_id = row.name
@@ -96,65 +130,293 @@ def generate_anomalies_json(output_file: str, anomaly_records: Dict) -> None:
     with open(output_file, "w", encoding="utf-8") as f:
         json.dump(anomaly_records, f, ensure_ascii=False, indent=2)
 
-def main():
-    # Load input data
-    raw_data = pd.read_csv("inventory_raw.csv")
-    raw_data = raw_data.set_index("source_row_id")
+def generate_metrics_json(output_file: str, metrics: Dict) -> None:
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(metrics, f, indent=2)
 
-    llm_client = GPTClient()
+def add_llm_transport_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--llm-transport", choices=TRANSPORT_MODES, default="openai", help="openai: live API; record: live API, saved to --llm-fixture; replay: serve --llm-fixture offline; fake: deterministic synthetic answers")
+    parser.add_argument("--llm-fixture", default="llm_fixture.jsonl", help="Request/response fixture for --llm-transport record/replay")
+    parser.add_argument("--llm-latency-ms", type=float, default=None, help="Synthetic latency per request for replay (default: as recorded) and fake (default: 0)")
 
-    # Process each field
-    ip_norm_df = apply_and_expand(raw_data, process_ipv4, input_cols=["ip"])
-    mac_norm_df = apply_and_expand(ip_norm_df, process_mac, input_cols=["mac"])
-    site_norm_df = apply_and_expand(mac_norm_df, normalize_site_name, input_cols=["site"])
-    hostname_norm_df = apply_and_expand(site_norm_df, process_hostname, input_cols=["hostname"])
-    fqdn_norm_df = apply_and_expand(hostname_norm_df, process_fqdn, input_cols=["fqdn"])
-    owner_norm_df = apply_and_expand(fqdn_norm_df, process_owner, input_cols=["owner"], llm=llm_client, system_prompt=system_prompt, owner_prompt=owner_prompt)
-    device_norm_df = apply_and_expand(owner_norm_df, process_device, ["hostname", "device_type", "notes"], llm=llm_client, system_prompt=system_prompt, device_prompt=device_prompt)
+def build_llm_client(args: argparse.Namespace) -> GPTClient:
+    transport = make_transport(args.llm_transport, fixture_path=args.llm_fixture, latency_ms=args.llm_latency_ms)
+    return GPTClient(token_budget=args.token_budget, transport=transport)
 
-    # # Save enriched DataFrame to CSV
-    # device_norm_df.to_csv("inventory_enriched.csv", index=False)
+def checkpoint_settings(args: argparse.Namespace, llm_client: Optional[GPTClient]) -> Dict:
+    """
+    Settings that determine the checkpointed stage results; --resume refuses to reuse chunks
+    written with different ones.
+    """
+    from pathlib import Path
 
-    # Collect anomalies
-    anomalies = collect_anomalies(device_norm_df)
+    prompts = [system_prompt, owner_prompt, device_prompt, owner_device_prompt, json.dumps([OWNER_SCHEMA, DEVICE_SCHEMA, OWNER_DEVICE_SCHEMA])]
+    settings = {
+        "llm_enabled": llm_client is not None,
+        "fused_llm": args.fused_llm,
+        # Chunks are positional within a shard, so the shard assignment decides which rows they hold
+        "shards": args.shards,
+        "shard_index": args.shard_index if args.shards > 1 else None,
+    }
+    if llm_client is not None:
+        settings.update({
+            # record sends requests to the live API just like openai
+            "llm_transport": "openai" if args.llm_transport == "record" else args.llm_transport,
+            "llm_fixture": str(Path(args.llm_fixture).resolve()) if args.llm_transport == "replay" else None,
+            "model": llm_client.model,
+            "temperature": llm_client.temperature,
+            "prompts_sha256": hashlib.sha256("\0".join(prompts).encode("utf-8")).hexdigest(),
+            "token_budget": args.token_budget,
+        })
+    return settings
 
-    # Generate anomalies JSON file
-    generate_anomalies_json("anomalies.json", anomalies)
-
-    # Clean up dataframe
-    normalization_steps_columns = [c for c in device_norm_df.columns if c.endswith("normalization_steps")]
-    device_norm_df["normalization_steps"] = device_norm_df[normalization_steps_columns].fillna("").agg("|".join, axis=1)
-    columns_of_interest = [
-        'notes',
-        'ip_out',
-        'ip_valid',
-        'ip_version',
-        'ip_reverse_ptr',
-        'ip_classification',
-        'subnet_cidr',
-        'mac_out',
-        'mac_valid',
-        'mac_kind',
-        'site_out',
-        'hostname_out',
-        'hostname_valid',
-        'hostname_kind',
-        'fqdn_out',
-        'fqdn_valid',
-        'fqdn_kind',
-        'owner_out',
-        'owner_email',
-        'owner_team',
-        'device_out',
-        'device_type_confidence',
-    ]
-    clean_df = device_norm_df[columns_of_interest]
-    clean_df.rename(
+def utc_timestamp(value: str):
+    """argparse type for ISO 8601 timestamps; times without an offset are taken as UTC."""
+    from datetime import datetime, timezone
+
+    try:
+        when = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected an ISO 8601 timestamp, got {value!r}")
+    return when if when.tzinfo is not None else when.replace(tzinfo=timezone.utc)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Clean and normalize inventory_raw.csv")
+    parser.add_argument("--input", default="inventory_raw.csv", help="Raw inventory (.csv, .parquet or .arrow/.feather)")
+    parser.add_argument("--output", default="inventory_clean.csv", help="Clean inventory; the format follows the extension (.csv, .parquet or .arrow/.feather)")
+    parser.add_argument("--anomalies", default="anomalies.json", help="Anomalies JSON output")
+    parser.add_argument("--metrics", default="metrics.json", help="Run metrics JSON output")
+    parser.add_argument("--no-llm", action="store_true", help="Run only the deterministic stages (IP, MAC, site, hostname, FQDN); owner and device are marked as skipped")
+    parser.add_argument("--llm-workers", type=int, default=1, help="Concurrent LLM requests per stage")
+    parser.add_argument("--fused-llm", action="store_true", help="Extract owner and device with a single LLM request per row")
+    parser.add_argument("--run-dir", default=".run", help="Directory for per-stage, per-chunk checkpoints")
+    parser.add_argument("--resume", action="store_true", help="Reuse completed chunks from --run-dir; the input file must be unchanged")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Rows per checkpointed chunk")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not write checkpoints")
+    add_llm_transport_arguments(parser)
+    parser.add_argument("--token-budget", type=int, default=None, help="Hard cap on LLM tokens (prompt + completion) for the whole run; rows beyond it are not sent to the LLM")
+    parser.add_argument("--dhcp-leases", nargs="+", default=[], help="ISC dhcpd lease files (optionally .gz) to correlate against the clean inventory")
+    parser.add_argument("--arp-dumps", nargs="+", default=[], help="ARP/neighbor dumps (ip neigh, arp -an or /proc/net/arp; optionally .gz) to correlate against the clean inventory")
+    parser.add_argument("--arp-observed-at", type=utc_timestamp, default=None, help="When the --arp-dumps were taken (ISO 8601, UTC unless an offset is given); without it ARP entries are undated")
+    parser.add_argument("--stale-days", type=float, default=30, help="Flag records last seen this many days before the newest log entry")
+    parser.add_argument("--shards", type=int, default=1, help="Split the input into this many shards by hash of source_row_id")
+    parser.add_argument("--shard-index", type=int, default=None, help="Shard processed by this invocation (0-based)")
+    parser.add_argument("--shard-dir", default=".shards", help="Shared directory where shards write their outputs")
+    parser.add_argument("--merge", action="store_true", help="Merge the completed shards in --shard-dir into --output, --anomalies and --metrics")
+    parser.add_argument("--local-shards", type=int, default=None, help="Run this many shards as local processes, then merge")
+    return parser.parse_args()
+
+def normalize_records(raw_data: pd.DataFrame, llm_client: Optional[GPTClient], llm_workers: int = 1, checkpoint: Optional[CheckpointStore] = None, fused_llm: bool = False) -> pd.DataFrame:
+    """
+    Run every normalization stage over raw_data (indexed by source_row_id) and return the
+    enriched dataframe with the *_out, *_issues, *_recommended_action and *_normalization_steps columns.
+    Without an llm_client only the deterministic stages run and owner/device are marked as skipped.
+    With a checkpoint store every stage is run chunk by chunk and completed chunks are persisted.
+    With fused_llm, owner and device are extracted with one LLM request per row.
+    """
+    ip_norm_df = apply_and_expand(raw_data, process_ipv4, input_cols=["ip"], checkpoint=checkpoint)
+    mac_norm_df = apply_and_expand(ip_norm_df, process_mac, input_cols=["mac"], checkpoint=checkpoint)
+    site_norm_df = apply_and_expand(mac_norm_df, normalize_site_name, input_cols=["site"], checkpoint=checkpoint)
+    hostname_norm_df = apply_and_expand(site_norm_df, process_hostname, input_cols=["hostname"], checkpoint=checkpoint)
+    fqdn_norm_df = apply_and_expand(hostname_norm_df, process_fqdn, input_cols=["fqdn"], checkpoint=checkpoint)
+    if llm_client is None:
+        owner_norm_df = apply_and_expand(fqdn_norm_df, skip_owner, input_cols=["owner"], checkpoint=checkpoint)
+        device_norm_df = apply_and_expand(owner_norm_df, skip_device, input_cols=["device_type"], checkpoint=checkpoint)
+        return device_norm_df
+    if fused_llm:
+        return apply_and_expand(fqdn_norm_df, process_owner_device, ["owner", "device_type", "hostname", "notes"], checkpoint=checkpoint, workers=llm_workers, llm=llm_client, system_prompt=system_prompt, owner_device_prompt=owner_device_prompt, owner_prompt=owner_prompt, device_prompt=device_prompt)
+    owner_norm_df = apply_and_expand(fqdn_norm_df, process_owner, input_cols=["owner"], checkpoint=checkpoint, workers=llm_workers, llm=llm_client, system_prompt=system_prompt, owner_prompt=owner_prompt)
+    device_norm_df = apply_and_expand(owner_norm_df, process_device, ["device_type", "hostname", "notes"], checkpoint=checkpoint, workers=llm_workers, llm=llm_client, system_prompt=system_prompt, device_prompt=device_prompt)
+    return device_norm_df
+
+CLEAN_COLUMNS = [
+    'notes',
+    'ip_out',
+    'ip_valid',
+    'ip_version',
+    'ip_reverse_ptr',
+    'ip_classification',
+    'subnet_cidr',
+    'mac_out',
+    'mac_valid',
+    'mac_kind',
+    'site_out',
+    'hostname_out',
+    'hostname_valid',
+    'hostname_kind',
+    'fqdn_out',
+    'fqdn_valid',
+    'fqdn_kind',
+    'owner_out',
+    'owner_email',
+    'owner_team',
+    'device_out',
+    'device_type_confidence',
+]
+
+def build_clean_frame(enriched_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduce the enriched dataframe to the clean inventory columns, with *_out renamed to the field name.
+    """
+    normalization_steps_columns = [c for c in enriched_df.columns if c.endswith("normalization_steps")]
+    enriched_df["normalization_steps"] = enriched_df[normalization_steps_columns].fillna("").agg("|".join, axis=1)
+    clean_df = enriched_df[CLEAN_COLUMNS]
+    return clean_df.rename(
         columns = {
             col: col[:col.index("_out")] for col in clean_df.columns if col.endswith("_out")
-        }, inplace=True
+        }
     )
-    clean_df.to_csv("inventory_clean.csv", index=True)
+
+def empty_clean_frame(index: pd.Index) -> pd.DataFrame:
+    """
+    Clean inventory with the declared columns and no rows, for a shard that received no records.
+    """
+    import pandas as pd
+
+    return pd.DataFrame(index=index, columns=[col[:col.index("_out")] if col.endswith("_out") else col for col in CLEAN_COLUMNS])
+
+def run_local_shards(args: argparse.Namespace) -> None:
+    """
+    Run every shard as a separate local process against the shared --shard-dir, then merge.
+    Stands in for a multi-host run, where each host runs one --shard-index.
+    """
+    import subprocess
+    import sys
+
+    # Forward the caller's options, replacing --local-shards with an explicit shard assignment
+    forwarded = []
+    argv = iter(sys.argv[1:])
+    for arg in argv:
+        if arg == "--local-shards":
+            next(argv, None)
+        elif not arg.startswith("--local-shards="):
+            forwarded.append(arg)
+    processes = [
+        subprocess.Popen([
+            sys.executable, __file__, *forwarded,
+            "--shards", str(args.local_shards),
+            "--shard-index", str(shard_index),
+            "--shard-dir", args.shard_dir,
+        ])
+        for shard_index in range(args.local_shards)
+    ]
+    failed = [shard_index for shard_index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise SystemExit(f"Shards failed: {', '.join(str(i) for i in failed)}")
+    merge_shard_outputs(args.shard_dir, args.local_shards, args)
+
+def merge_shard_outputs(shard_dir: str, shards: int, args: argparse.Namespace) -> None:
+    from pipeline.shard import merge_shards
+
+    try:
+        clean_df, anomalies, metrics = merge_shards(shard_dir, shards)
+    except FileNotFoundError as e:
+        raise SystemExit(str(e))
+    write_final_outputs(clean_df, anomalies, metrics, args)
+
+def write_final_outputs(clean_df: pd.DataFrame, anomalies: List[Dict], metrics: Dict, args: argparse.Namespace) -> None:
+    """
+    Run the cross-row checks and the DHCP/ARP correlation over the complete clean inventory
+    and write the run outputs.
+    """
+    from pipeline.consistency import find_cross_row_conflicts, merge_anomalies
+    from pipeline.storage import write_clean_table
+
+    conflicts = find_cross_row_conflicts(clean_df)
+    anomalies = merge_anomalies(anomalies, conflicts)
+
+    if args.dhcp_leases or args.arp_dumps:
+        from pipeline.netstate import correlate_network_state
+
+        clean_df, netstate_anomalies, netstate_stats = correlate_network_state(
+            clean_df, args.dhcp_leases, args.arp_dumps, stale_days=args.stale_days, arp_observed_at=args.arp_observed_at
+        )
+        anomalies = merge_anomalies(anomalies, netstate_anomalies)
+        metrics = {**metrics, **netstate_stats, "netstate_anomalies": len(netstate_anomalies)}
+
+    # Generate anomalies JSON file
+    generate_anomalies_json(args.anomalies, anomalies)
+    write_clean_table(clean_df, args.output)
+    generate_metrics_json(args.metrics, {**metrics, "cross_row_conflicts": len(conflicts)})
+
+def main():
+    args = parse_args()
+    if args.local_shards:
+        run_local_shards(args)
+        return
+    if args.merge:
+        merge_shard_outputs(args.shard_dir, args.shards, args)
+        return
+
+    from pathlib import Path
+    from pipeline.storage import read_table, write_clean_table
+    from pipeline.checkpoint import CheckpointMismatch, CheckpointStore
+    from pipeline.shard import DONE_MARKER, select_shard, shard_output_dir, write_shard_done
+
+    sharded = args.shards > 1
+    if sharded:
+        if args.shard_index is None or not 0 <= args.shard_index < args.shards:
+            raise SystemExit(f"--shard-index must be between 0 and {args.shards - 1}")
+        out_dir = shard_output_dir(args.shard_dir, args.shard_index)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        (out_dir / DONE_MARKER).unlink(missing_ok=True)
+
+    # The OpenAI client itself is only created on the first LLM request
+    llm_client = None if args.no_llm else build_llm_client(args)
+
+    checkpoint = None
+    if not args.no_checkpoint:
+        run_dir = Path(args.run_dir) / f"shard-{args.shard_index:05d}" if sharded else Path(args.run_dir)
+        checkpoint = CheckpointStore(str(run_dir), chunk_size=args.chunk_size)
+        try:
+            checkpoint.start(args.input, resume=args.resume, settings=checkpoint_settings(args, llm_client))
+        except CheckpointMismatch as e:
+            raise SystemExit(f"Cannot resume: {e}" if args.resume else str(e))
+
+    # Load input data
+    raw_data = read_table(args.input)
+    raw_data = raw_data.set_index("source_row_id")
+    if sharded:
+        raw_data = select_shard(raw_data, args.shards, args.shard_index)
+
+    if raw_data.empty:
+        # Hash sharding can leave a shard without records; it still writes (empty) outputs so the merge can run
+        anomalies = []
+        clean_df = empty_clean_frame(raw_data.index)
+    else:
+        # Process each field
+        try:
+            device_norm_df = normalize_records(raw_data, llm_client, llm_workers=args.llm_workers, checkpoint=checkpoint, fused_llm=args.fused_llm)
+        except CheckpointMismatch as e:
+            raise SystemExit(f"Cannot resume: {e}")
+
+        # # Save enriched DataFrame to CSV
+        # device_norm_df.to_csv("inventory_enriched.csv", index=False)
+
+        # Collect anomalies
+        anomalies = collect_anomalies(device_norm_df)
+
+        # Clean up dataframe
+        clean_df = build_clean_frame(device_norm_df)
+
+    # Record LLM usage for the run
+    metrics = {
+        "rows": len(clean_df),
+        "llm_enabled": llm_client is not None,
+        **(llm_client.stats() if llm_client else {}),
+        **(checkpoint.stats() if checkpoint else {}),
+    }
+
+    if sharded:
+        # Cross-row checks need every shard, so they run after the merge
+        clean_file = "inventory_clean" + Path(args.output).suffix
+        write_clean_table(clean_df, str(out_dir / clean_file))
+        generate_anomalies_json(str(out_dir / "anomalies.json"), anomalies)
+        generate_metrics_json(str(out_dir / "metrics.json"), metrics)
+        write_shard_done(out_dir, args.shards, args.shard_index, clean_file)
+        return
+
+    write_final_outputs(clean_df, anomalies, metrics, args)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
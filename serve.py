@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Long-running normalization service.
+
+Exposes the run.py pipeline over local HTTP so single records can be normalized at
+provisioning time without paying interpreter start-up, imports, GPTClient construction
+and a cold LLM cache on every call.
+
+  POST /normalize   body: one raw record, a list of records, or {"records": [...]}
+                    returns {"rows": [...], "anomalies": [...]} in inventory_clean row schema
+  GET  /stats       request/record counts, batch sizes, p50/p99 latency and LLM usage
+  GET  /healthz     liveness
+
+Concurrent requests are micro-batched: records arriving within --max-wait-ms of each other
+are normalized together so the LLM stages see one batch and can fan it out over --llm-workers.
+"""
+import argparse
+import itertools
+import json
+import math
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from pipeline.llm import GPTClient
+from pipeline.storage import apply_clean_schema
+from run import add_llm_transport_arguments, build_clean_frame, build_llm_client, collect_anomalies, normalize_records
+
+RAW_COLUMNS = ["source_row_id", "ip", "hostname", "fqdn", "mac", "owner", "device_type", "site", "notes"]
+
+class LatencyStats:
+    """Rolling window of request latencies with percentile summaries."""
+
+    def __init__(self, window: int = 10000):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.records = 0
+        self.errors = 0
+
+    def record(self, seconds: float, records: int) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+            self.requests += 1
+            self.records += records
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    @staticmethod
+    def _percentile(ordered: List[float], pct: float) -> float:
+        # Nearest-rank percentile
+        rank = max(1, math.ceil(pct / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    def summary(self) -> Dict:
+        with self._lock:
+            ordered = sorted(self._latencies)
+            summary = {"requests": self.requests, "records": self.records, "errors": self.errors}
+        if ordered:
+            summary["latency_ms"] = {
+                "p50": round(self._percentile(ordered, 50) * 1000, 3),
+                "p99": round(self._percentile(ordered, 99) * 1000, 3),
+                "max": round(ordered[-1] * 1000, 3),
+                "window": len(ordered),
+            }
+        return summary
+
+class MicroBatcher:
+    """
+    Collects records from concurrent requests into batches and runs the pipeline once per batch.
+    A batch closes when it reaches max_batch_size records or max_wait_ms after its first record.
+    """
+
+    def __init__(self, llm_client: GPTClient, max_batch_size: int = 64, max_wait_ms: float = 5.0, llm_workers: int = 8, fused_llm: bool = False):
+        self.llm_client = llm_client
+        self.fused_llm = fused_llm
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.llm_workers = llm_workers
+        self.batches = 0
+        self.batched_records = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, records: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Normalize records; blocks until their batch has been processed."""
+        future: Future = Future()
+        self._queue.put((records, future))
+        return future.result()
+
+    def stats(self) -> Dict:
+        return {
+            "batches": self.batches,
+            "mean_batch_size": round(self.batched_records / self.batches, 2) if self.batches else 0,
+        }
+
+    def _run(self) -> None:
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            try:
+                results = self._process([records for records, _ in pending])
+            except Exception as e:
+                if len(pending) == 1:
+                    pending[0][1].set_exception(e)
+                    continue
+                # Re-run each request on its own so only the one with the failing record gets the error;
+                # LLM answers already received for the batch are served from the client's cache
+                for records, future in pending:
+                    try:
+                        future.set_result(self._process([records])[0])
+                    except Exception as request_error:
+                        future.set_exception(request_error)
+                continue
+            for (_, future), result in zip(pending, results):
+                future.set_result(result)
+
+    def _process(self, requests: List[List[Dict]]) -> List[Tuple[List[Dict], List[Dict]]]:
+        # Records from different requests may share source_row_ids, so the batch is indexed
+        # by position and the caller's ids are restored afterwards. Records without an id get
+        # their position within their own request, independent of what else is in the batch.
+        records = list(itertools.chain.from_iterable(requests))
+        raw_data = pd.DataFrame(records, columns=RAW_COLUMNS)
+        original_ids = [
+            record.get("source_row_id") if record.get("source_row_id") is not None else position
+            for request in requests
+            for position, record in enumerate(request)
+        ]
+        raw_data = raw_data.drop(columns=["source_row_id"])
+        raw_data.index = pd.RangeIndex(len(records), name="source_row_id")
+        raw_data = raw_data.where(raw_data.notna(), float("nan"))
+
+        enriched_df = normalize_records(raw_data, self.llm_client, llm_workers=self.llm_workers, fused_llm=self.fused_llm)
+        anomalies = collect_anomalies(enriched_df)
+        clean_df = apply_clean_schema(build_clean_frame(enriched_df))
+        clean_df = clean_df.astype(object).where(clean_df.notna(), None)
+
+        rows = []
+        for position, row in enumerate(clean_df.itertuples(index=False)):
+            rows.append({"source_row_id": original_ids[position], **row._asdict()})
+        for position, anomaly in enumerate(anomalies):
+            anomaly["source_row_id"] = original_ids[position]
+
+        self.batches += 1
+        self.batched_records += len(records)
+
+        results = []
+        start = 0
+        for request in requests:
+            end = start + len(request)
+            results.append((rows[start:end], anomalies[start:end]))
+            start = end
+        return results
+
+def make_handler(batcher: MicroBatcher, stats: LatencyStats, max_request_records: int):
+    class NormalizeHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status: int, payload) -> None:
+            body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send_json(200, {**stats.summary(), **batcher.stats(), "llm": batcher.llm_client.stats()})
+            elif self.path == "/healthz":
+                self._send_json(200, {"status": "ok"})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/normalize":
+                self._send_json(404, {"error": "not found"})
+                return
+            start = time.perf_counter()
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"null")
+            except (ValueError, json.JSONDecodeError):
+                stats.record_error()
+                self._send_json(400, {"error": "body must be JSON"})
+                return
+
+            if isinstance(payload, dict) and "records" in payload:
+                records = payload["records"]
+            elif isinstance(payload, dict):
+                records = [payload]
+            else:
+                records = payload
+            if not isinstance(records, list) or not records or not all(isinstance(r, dict) for r in records):
+                stats.record_error()
+                self._send_json(400, {"error": "expected a record object or a non-empty list of records"})
+                return
+            if len(records) > max_request_records:
+                stats.record_error()
+                self._send_json(413, {"error": f"at most {max_request_records} records per request; use run.py for bulk files"})
+                return
+
+            try:
+                rows, anomalies = batcher.submit(records)
+            except Exception as e:
+                stats.record_error()
+                self._send_json(500, {"error": str(e)})
+                return
+            stats.record(time.perf_counter() - start, len(records))
+            self._send_json(200, {"rows": rows, "anomalies": anomalies})
+
+        def log_message(self, format, *args):
+            # Per-request access logs would dominate latency at provisioning volumes
+            pass
+
+    return NormalizeHandler
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serve the inventory normalization pipeline over local HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=64, help="Records per micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="How long a micro-batch waits for more records")
+    parser.add_argument("--max-request-records", type=int, default=1000)
+    parser.add_argument("--llm-workers", type=int, default=8, help="Concurrent LLM requests per stage within a batch")
+    parser.add_argument("--fused-llm", action="store_true", help="Extract owner and device with a single LLM request per record")
+    parser.add_argument("--token-budget", type=int, default=None, help="Hard cap on LLM tokens for the lifetime of the server")
+    add_llm_transport_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    # Built once and kept warm for the lifetime of the process
+    llm_client = build_llm_client(args)
+    batcher = MicroBatcher(llm_client, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms, llm_workers=args.llm_workers, fused_llm=args.fused_llm)
+    stats = LatencyStats()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher, stats, args.max_request_records))
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()